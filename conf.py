@@ -13,14 +13,17 @@ https://www.sphinx-doc.org/en/master/usage/configuration.html
 """
 
 # Python imports
-import datetime
-import subprocess
 import sys
+import time
+from functools import lru_cache
 from os import getenv
-from os.path import abspath, dirname, join
+from os.path import abspath, dirname, isfile, join
 
 # Determine the absolute path of the repository's root
-REPO_ROOT = dirname(abspath(__file__))
+#
+# The ``Makefile`` provides the path through the environment, so it is only
+# derived from this file's location if Sphinx is run directly.
+REPO_ROOT = getenv("REPO_ROOT") or dirname(abspath(__file__))
 
 # Add the project-specific extensions directory to Python's path
 sys.path.append(join(REPO_ROOT, "extensions"))
@@ -32,13 +35,119 @@ sys.path.append(join(REPO_ROOT, "extensions"))
 # and https://stackoverflow.com/a/61223300
 running_ci = getenv("CI", False)
 
+# Determine if this is an actual release build of the website
+#
+# Release builds are requested by setting the environment variable
+# ``SPHINX_RELEASE`` (see the ``Makefile``'s build recipe). CI runs are always
+# considered release builds.
+release_build = getenv("SPHINX_RELEASE", False) or running_ci
+
+
+def _read_head_sha(repo_root):
+    """Read the current commit's hash directly from the ``.git`` directory.
+
+    ``HEAD`` either contains the hash itself (*detached HEAD*) or a reference
+    to a branch (``ref: refs/heads/...``). The branch's hash is looked up in
+    the *loose* reference file first and then in ``packed-refs``.
 
+    Linked worktrees (and submodules) are supported aswell: their ``.git`` is a
+    file pointing to the actual git directory, which may in turn point to the
+    *common* directory holding the references.
+
+    Returns
+    -------
+    str, None
+        The commit's hash. ``None`` is returned if the hash could not be
+        determined this way.
+    """
+    git_dir = join(repo_root, ".git")
+
+    if isfile(git_dir):
+        try:
+            with open(git_dir) as f:
+                gitdir_ref = f.read().strip()
+        except OSError:
+            return None
+        if not gitdir_ref.startswith("gitdir:"):
+            return None
+        git_dir = join(repo_root, gitdir_ref[7:].strip())
+
+    common_dir = git_dir
+    try:
+        with open(join(git_dir, "commondir")) as f:
+            common_dir = join(git_dir, f.read().strip())
+    except OSError:
+        pass
+
+    try:
+        with open(join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+
+    if not head.startswith("ref:"):
+        return head or None
+
+    ref = head[4:].strip()
+
+    try:
+        with open(join(common_dir, ref)) as f:
+            return f.read().strip()
+    except OSError:
+        pass
+
+    try:
+        with open(join(common_dir, "packed-refs")) as f:
+            for line in f:
+                # ``packed-refs`` contains lines of the form ``<hash> <ref>``
+                # aswell as comments (``#``) and peeled tags (``^``).
+                if line.startswith(("#", "^")):
+                    continue
+                sha, _, name = line.strip().partition(" ")
+                if name == ref:
+                    return sha
+    except OSError:
+        pass
+
+    return None
+
+
+@lru_cache(maxsize=1)
 def get_current_git_commit_hash():
     """Return the current commit's hash.
 
+    If the commit's hash is already known (e.g. in CI), it may be provided
+    using the environment variable ``GIT_COMMIT_SHA``, which avoids spawning
+    a ``git`` subprocess. Otherwise the hash is read from the repository's
+    ``.git`` directory (see ``_read_head_sha()``) and only if that fails,
+    ``git`` is actually run.
+
+    The result is cached, so ``git`` is run at most once per process.
+
     https://stackoverflow.com/a/21901260
     """
-    return subprocess.check_output(["git", "rev-parse", "HEAD"]).decode("ascii").strip()
+    commit_hash = getenv("GIT_COMMIT_SHA", None)
+    if commit_hash:
+        return commit_hash.strip()
+
+    commit_hash = _read_head_sha(REPO_ROOT)
+    if commit_hash:
+        return commit_hash
+
+    # ``subprocess`` is only imported, if ``git`` has to be run.
+    # Python imports
+    import subprocess
+
+    # ``rev-parse`` is a read-only operation, so ``git`` doesn't need to take
+    # any (optional) locks. Running it in the repository's root spares ``git``
+    # the search for the repository.
+    return (
+        subprocess.check_output(
+            ["git", "--no-optional-locks", "rev-parse", "HEAD"], cwd=REPO_ROOT
+        )
+        .decode("ascii")
+        .strip()
+    )
 
 
 # ### General project information
@@ -49,9 +158,15 @@ def get_current_git_commit_hash():
 # https://www.sphinx-doc.org/en/master/usage/configuration.html#project-information
 project = "mischback.de"
 author = "Mischback"
-copyright = "{}, {}".format(datetime.datetime.now().year, author)
+copyright = f"{time.gmtime().tm_year}, {author}"
 version = "0.0.1-alpha"
-release = get_current_git_commit_hash()
+# The commit's hash is only determined for release builds. Development builds
+# use a placeholder, which avoids touching the repository and keeps Sphinx's
+# environment valid between commits (``release`` is an ``env`` config value).
+#
+# The actual lookup is deferred until Sphinx has loaded the configuration, see
+# ``set_release()`` below.
+release = "dev"
 
 
 # ### General configuration
@@ -62,15 +177,9 @@ release = get_current_git_commit_hash()
 #
 # For a list of built-in extensions, see
 # https://www.sphinx-doc.org/en/master/usage/extensions/index.html#built-in-extensions
-extensions = [
-    # Automatically generate labels for sections.
-    #
-    # https://www.sphinx-doc.org/en/master/usage/extensions/autosectionlabel.html
-    "sphinx.ext.autosectionlabel",
-    # Measures ``sphinx``'s processing, primarily for debugging.
-    #
-    # https://www.sphinx-doc.org/en/master/usage/extensions/duration.html
-    "sphinx.ext.duration",
+#
+# The list is provided as a ``tuple``, as it is not meant to be modified.
+extensions = (
     # Shorter notation for external links.
     #
     # Not really sure, if this will be useful for this project, but it works
@@ -87,6 +196,9 @@ extensions = [
     "mischback.content_tags",
     "mischback.responsive_images",
     "mischback.sphinx_jinja2_debug",
+    # "sphinx.ext.autosectionlabel"
+    # Automatically generate labels for sections. Currently unused, as the
+    # content does not reference any sections.
     # "sphinx.ext.graphviz"
     # If there is a use-case for these diagrams.
     # "sphinx.ext.ifconfig"
@@ -94,7 +206,16 @@ extensions = [
     # "sphinx.ext.intersphinx"
     # If there is a use-case for this. Might better be realized using
     # ``extlinks``.
-]
+)
+
+# Measures ``sphinx``'s processing, primarily for debugging.
+#
+# The extension hooks into the reading of every document, so it is only
+# activated on request by setting the environment variable ``SPHINX_PROFILE``.
+#
+# https://www.sphinx-doc.org/en/master/usage/extensions/duration.html
+if getenv("SPHINX_PROFILE", False):
+    extensions += ("sphinx.ext.duration",)
 
 
 # This document contains the *master TOC*.
@@ -176,9 +297,6 @@ if running_ci:
 # TODO: Hopefully this is just a temporary required fix:
 linkcheck_ignore = [r"https://stackoverflow.com/.*"]
 
-# Prefix the automatically generated section labels with the document.
-autosectionlabel_prefix_document = True
-
 # The shortcuts for ``sphinx.ext.extlinks``.
 extlinks = {
     "commit": ("https://github.com/Mischback/mischback.de/commit/%s", "%s"),
@@ -186,7 +304,10 @@ extlinks = {
 }
 
 # Make ``sphinx.ext.extlinks`` emit warnings, if a shortcut is available.
-extlinks_detect_hardcoded_links = True
+#
+# This matches every external link against all shortcuts, so it is only done
+# for release builds (including CI), which will catch any hardcoded links.
+extlinks_detect_hardcoded_links = bool(release_build)
 
 notfound_urls_prefix = "/"
 # ``notfound_template`` is not specified here, as Sphinx normally renders the
@@ -242,3 +363,42 @@ html_permalinks_icon = "#"
 
 # Add additional static files that are not processed by Sphinx
 html_static_path = ["theme/mischback/static/icons/favicon.ico"]
+
+
+# ### Project-specific setup
+#
+# ``conf.py`` may provide a ``setup()`` function, just like an extension.
+#
+# https://www.sphinx-doc.org/en/master/usage/configuration.html#confval-extensions
+
+
+def set_release(app, config):
+    """Set ``release`` to the current commit's hash for release builds.
+
+    This function is meant to be attached to Sphinx's ``config-inited`` event,
+    which is emitted before the build environment is set up, so changes of
+    ``release`` are still detected by Sphinx.
+    """
+    if release_build:
+        config.release = get_current_git_commit_hash()
+
+
+def drop_foreign_metadata(app, env, docnames, other):
+    """Restrict the metadata of a parallel process to its own documents.
+
+    ``notfound.extension`` merges the *complete* metadata of parallel processes
+    and its ``EnvironmentCollector`` adds an entry for the 404 page in every
+    process. Thus, the actual metadata of the 404 page (including its
+    ``layout``) may get overwritten by another process.
+
+    This function is meant to be attached to Sphinx's ``env-merge-info`` event
+    and must run before ``notfound.extension``'s handler.
+    """
+    for docname in set(other.metadata) - set(docnames):
+        del other.metadata[docname]
+
+
+def setup(app):
+    """Register the project-specific event handlers with Sphinx."""
+    app.connect("config-inited", set_release)
+    app.connect("env-merge-info", drop_foreign_metadata, priority=400)
@@ -22,8 +22,7 @@ theme to provide the required markup.
 """
 
 # Python imports
-from collections import defaultdict
-from functools import total_ordering
+import sys
 
 # Sphinx imports
 from sphinx.util.docutils import SphinxDirective
@@ -31,129 +30,82 @@ from sphinx.util.docutils import SphinxDirective
 ENV_TAG_KEY = "ct_tags"
 """Key to track the tags in Sphinx's build environment.
 
-Provides a dictionary with *tags* as keys and sets of *document names* as
-values.
+Provides a dictionary with *tags* as keys and ``CTTag`` instances as values.
 """
 
+ENV_DOC_KEY = "ct_docs"
+"""Key to track the documents' tags in Sphinx's build environment.
 
-@total_ordering
-class CTDoc:
-    """Represent a (tagged) document.
-
-    Parameters
-    ----------
-    docname : str
-    doctitle : str
+Provides a dictionary with *document names* as keys and ``frozenset`` s of
+*tags* as values. This is the inverse of ``ENV_TAG_KEY`` and allows looking up
+the tags of a given document directly.
+"""
 
-    Attributes
-    ----------
-    docname : str
-        The document's location, relative to the source directory. May be used
-        to generate links to the document, either from reST sources (using
-        ``:doc:`[docname]```) or from Jinja2 templates (using
-        ``{{ pathto(docname) }}``).
-    title : str
-        The document's title, that is the first headline in the document.
-    """
+ENV_DOC_TAGS_KEY = "ct_doc_tags"
+"""Key to provide the documents' tags for rendering in Sphinx's environment.
 
-    def __init__(self, docname, doctitle):
-        self.docname = docname
-        self.title = doctitle
-
-    def __eq__(self, other):
-        """Check equality with ``other`` object."""
-        # see https://stackoverflow.com/a/2909119
-        # see https://stackoverflow.com/a/8796908
-        if isinstance(other, CTDoc):
-            return self.__key() == other.__key()
-        return NotImplemented
-
-    def __hash__(self):
-        """Provide a unique representation of the instance."""
-        # see https://stackoverflow.com/a/2909119
-        return hash(self.__key())
-
-    def __lt__(self, other):
-        """Check equality with ``other`` object."""
-        # see https://stackoverflow.com/a/8796908
-        if isinstance(other, CTDoc):
-            return self.__key() < other.__key()
-        return NotImplemented
+Provides a dictionary with *document names* as keys and ``tuple`` s of
+``(name, pagename)`` tuples, sorted by the tags' names, as values. This is
+derived from ``ENV_DOC_KEY`` and ``ENV_TAG_KEY`` once all documents are read,
+see ``update_doc_tags()``.
+"""
 
-    def __repr__(self):
-        """Provide an instance's ``representation``."""
-        # see https://stackoverflow.com/a/12448200
-        return "<CTDoc(docname={}, doctitle={})>".format(
-            self.docname.__repr__(), self.title.__repr__()
-        )
+_tag_set_cache = {}
+"""Intern identical sets of tags.
 
-    def __key(self):
-        """Provide internal representation of the instance."""
-        # see https://stackoverflow.com/a/2909119
-        return (self.docname, self.title)
+Many documents share the same combination of tags. Using the very same
+``frozenset`` instance for all of them keeps the pickled build environment
+small.
+"""
 
 
 class CTTag:
     """The logical representation of a tag.
 
-    Provides a list of documents (``CTDoc`` instances), that are tagged with
-    the instances ``name``.
+    Provides the documents, that are tagged with the instances ``name``. The
+    documents are represented by their ``docname`` and their ``title``.
 
     Parameters
     ----------
     name : str
+    pagename : str
 
     Attributes
     ----------
     name : str
-        The actual *value* of the tag. It is stored in *lowercase* only.
+        The actual *value* of the tag. It is stored in *lowercase* only. The
+        name is expected to be normalized already (see
+        ``ContentTagDirective.run()``).
     pagename : str
-        This is the pagename for this tag.
-    _docs : set
-        A set of ``CTDoc`` instances. This should not be accessed directly,
-        instead the methods ``add_doc`` and ``get_docs`` should be used.
+        This is the pagename for this tag. It is derived from Sphinx's
+        configuration value ``ct_tag_page_url_template``, see
+        ``ContentTagDirective``.
+    _docs : dict
+        A dictionary of the documents' titles, using their ``docname`` as keys.
+        The ``docname`` is the document's location, relative to the source
+        directory and may be used to generate links to the document. The
+        ``title`` is the first headline in the document. This should not be
+        accessed directly, instead the methods ``add_doc``, ``rm_doc`` and
+        ``set_doc_title`` should be used.
     doc_count : number
         The count of documents for a given tag.
     """
 
-    def __init__(self, name):
-        self.name = name.strip().lower()
-        # During object initialization, the ``pagename`` is not determined!
-        # Instead, the first call to ``add_doc()`` will set the ``pagename``
-        # for the object.
-        #
-        # Reasoning: Objects of this class are not directly created /
-        # initialized in this extension, instead they are created using a
-        # custom ``defaultdict`` implementation (see ``TagDefaultDict`` below)
-        # while the very first document is added to the desired tag.
-        #
-        # The ``pagename`` should be dependent on a Sphinx configuration value,
-        # thus the template to create the ``pagename`` can not be hardcoded in
-        # ``TagDefaultDict`` but must be provided when Sphinx's config has
-        # been fully evaluated.
-        self.pagename = None
-        self._docs = set()
+    def __init__(self, name, pagename):
+        self.name = name
+        self.pagename = pagename
+        self._docs = {}
         self.doc_count = len(self._docs)
 
-    def add_doc(self, docname, doctitle, pagename_template="tags/{}"):
+    def add_doc(self, docname, doctitle):
         """Add a document to the tag.
 
-        Documents are represented by instances of ``CTDoc``.
-
         Parameters
         ----------
         docname : str
         doctitle : str
-
-        Side Effects
-        ------------
-        The very first call to ``add_doc`` will set the object's ``pagename``
-        attribute. Reasons are mostly implementation details, see comments in
-        the class's ``__init__()``.
         """
-        if self.pagename is None:
-            self.pagename = pagename_template.format(self.name)
-        self._docs.add(CTDoc(docname, doctitle))
+        self._docs[docname] = doctitle
         self.doc_count = len(self._docs)
 
     def rm_doc(self, docname):
@@ -166,29 +118,27 @@ class CTTag:
         ----------
         docname : str
         """
-        self._docs = {doc for doc in self._docs if not doc.docname == docname}
+        self._docs.pop(docname, None)
         self.doc_count = len(self._docs)
 
-    def set_doc_titles(self, titles):
-        """Set the titles of all tagged documents.
+    def set_doc_title(self, docname, doctitle):
+        """Set the title of a tagged document.
 
-        This method is called during the ``env-update`` event handler and will
-        update the titles of all documents.
+        This method is called during the ``env-update`` event handler.
 
         See ``update_doc_titles()`` for details of this operation.
 
         Parameters
         ----------
-        titles : dict
+        docname : str
+        doctitle : str
         """
-        for doc in self._docs:
-            # print("[DEBUG] -> {}".format(titles[doc.docname].astext()))
-            doc.title = titles[doc.docname].astext()
+        self._docs[docname] = doctitle
 
     def merge(self, other):
         """Merge two instances of this class.
 
-        After some sanity checks, it uses the ``set``'s ``update()`` method
+        After some sanity checks, it uses the ``dict``'s ``update()`` method
         to merge the documents.
 
         Parameters
@@ -209,63 +159,58 @@ class CTTag:
         ----------
         docname : str
         """
-        return len({doc for doc in self._docs if doc.docname == docname}) != 0
+        return docname in self._docs
 
     def __repr__(self):
         """Provide an instance's ``representation``."""
         # see https://stackoverflow.com/a/12448200
         return "<CTTag(name={})>".format(self.name)
 
-    def __getitem__(self, index):
+    def __iter__(self):
         """Make the objects iterable.
 
-        Notes
-        -----
-        - https://stackoverflow.com/a/7542261
-        - https://stackoverflow.com/a/15479974
+        This iterates the tagged documents as ``(docname, title)`` tuples,
+        ordered by their ``docname``. The order is independent of the order in
+        which the documents were read, so the rendered pages are stable between
+        builds.
         """
-        return list(self._docs)[index]
+        return iter(sorted(self._docs.items()))
 
+    def __len__(self):
+        """Get the number of tagged documents."""
+        return len(self._docs)
 
-class TagDefaultDict(defaultdict):
-    """Custom override for Python's ``defaultdict``.
 
-    This enables the defaultdict to use a (custom) class as its default while
-    passing the *desired* ``key`` to the constructor of that class.
+def init_env(app):
+    """Provide the extension's data structures in Sphinx's build environment.
 
-    While this implementation is pretty generic, it is meant to be used with
-    ``CTTag`` as its default.
-    """
+    This is done once, before any document is read. All other functions of
+    the extension rely on the data structures being available.
 
-    def __missing__(self, key):
-        """Create a new ``key`` with the provided default ``value``.
-
-        This passes the *desired* key to the constructor of the default class
-        for ``value``.
-        """
-        # see https://stackoverflow.com/a/32932568
-        self[key] = new = self.default_factory(key)
-        return new
+    This function is meant to be attached to Sphinx's ``builder-inited`` event.
+    """
+    if not hasattr(app.env, ENV_TAG_KEY):
+        setattr(app.env, ENV_TAG_KEY, {})
+    if not hasattr(app.env, ENV_DOC_KEY):
+        setattr(app.env, ENV_DOC_KEY, {})
 
 
 def add_tags_to_render_context(app, pagename, templatename, context, doctree):
     """Add the document's associated tags to the rendering context.
 
     The document's tags will be accessible as ``ct_document_tags`` in Jinja2
-    templates. This is a ``set`` of ``CTTag`` instances.
+    templates. This is a ``tuple`` of ``(name, pagename)`` tuples, sorted by
+    the tags' names. These are prepared by ``update_doc_tags()``, so this is a
+    single lookup per page.
 
     This function will not add ``ct_document_tags`` if there are no tags
     associated with the document.
     """
-    tags_raw = getattr(app.env, ENV_TAG_KEY, {})
-    tag_docs = {tags_raw[tag] for tag in tags_raw if tags_raw[tag].contains(pagename)}
+    doc_tags = getattr(app.env, ENV_DOC_TAGS_KEY).get(pagename)
 
     # only add tags to the rendering context if there actually are tags
-    if len(tag_docs) > 0:
-        context["ct_document_tags"] = tag_docs
-
-    # print("[DEBUG] evaluate_rendering_context() - {}".format(pagename))
-    # print("[DEBUG] context: {!r}".format(context))
+    if doc_tags:
+        context["ct_document_tags"] = doc_tags
 
 
 def add_tag_pages(app):
@@ -277,25 +222,18 @@ def add_tag_pages(app):
     configured using ``ct_tag_page_url_template`` in Sphinx's configuration.
 
     This function is meant to be attached to Sphinx's ``html-collect-pages``
-    event.
-    """
-    # print("[DEBUG] add_tag_pages()")
+    event. It is a generator, providing the pages one by one.
 
-    tags = getattr(app.env, ENV_TAG_KEY, {})
-    # print("[DEBUG] tags: {!r}".format(tags))
-
-    tag_pages = [(app.config.ct_tag_overview_url, {"ct_tags": tags}, "tag_index.html")]
+    The tags are provided sorted by their name, so the output does not depend
+    on the order in which the documents were read (which varies with parallel
+    builds).
+    """
+    tags = dict(sorted(getattr(app.env, ENV_TAG_KEY).items()))
 
-    for tag in tags:
-        tag_pages.append(
-            (
-                tags[tag].pagename,
-                {"ct_tag": tag, "ct_tag_docs": tags[tag]},
-                "tag.html",
-            )
-        )
+    yield (app.config.ct_tag_overview_url, {"ct_tags": tags}, "tag_index.html")
 
-    return tag_pages
+    for name, tag in tags.items():
+        yield (tag.pagename, {"ct_tag": name, "ct_tag_docs": tag}, "tag.html")
 
 
 def update_doc_titles(app, env):
@@ -303,19 +241,46 @@ def update_doc_titles(app, env):
 
     When the tags dictionary is built, the documents' titles may not be
     available yet. This function is executed, when Sphinx has finished all
-    parsing tasks and will update the ``title`` attributes of all ``CTDoc``
-    instances.
+    parsing tasks and will update the titles of all tagged documents.
 
-    This is a highly inefficient operation, as it will iterate over all tags
-    and all tagged documents.
+    The tagged documents are taken from the inverse index (``ENV_DOC_KEY``), so
+    every document's title is determined exactly once and is then set in the
+    document's tags only.
 
     This function is meant to be attached to Sphinx's ``env-updated`` event.
     """
     titles = env.titles
-    tags = getattr(app.env, ENV_TAG_KEY, {})
+    tags = getattr(env, ENV_TAG_KEY)
+
+    for docname, doc_tags in getattr(env, ENV_DOC_KEY).items():
+        doctitle = titles[docname].astext()
+        for tag in doc_tags:
+            tags[tag].set_doc_title(docname, doctitle)
+
+
+def update_doc_tags(app, env):
+    """Prepare the documents' tags for rendering.
+
+    For every tagged document, the names and pagenames of its tags are
+    collected once, after all documents are read, instead of looking them up
+    for every rendered page.
+
+    ``add_tags_to_render_context()`` is only attached to Sphinx's
+    ``html-page-context`` event, if there actually are tagged documents. Builds
+    without any tags don't pay for the handler on every page.
 
-    for tag in tags:
-        tags[tag].set_doc_titles(titles)
+    This function is meant to be attached to Sphinx's ``env-updated`` event.
+    """
+    tags = getattr(env, ENV_TAG_KEY)
+
+    doc_tags = {
+        docname: tuple((tag, tags[tag].pagename) for tag in sorted(doc_tags))
+        for docname, doc_tags in getattr(env, ENV_DOC_KEY).items()
+    }
+    setattr(env, ENV_DOC_TAGS_KEY, doc_tags)
+
+    if doc_tags:
+        app.connect("html-page-context", add_tags_to_render_context)
 
 
 def purge_document_from_tags(app, env, docname):
@@ -326,21 +291,17 @@ def purge_document_from_tags(app, env, docname):
     to a document must be removed from the cached tag information in order to
     allow changes / updates of the tags of a document.
 
+    The document's tags are looked up in the inverse index (``ENV_DOC_KEY``),
+    so only these tags are touched.
+
     This function is meant to be attached to Sphinx's ``env-purge-doc`` event
     and will enable the extension to work with parallel builds.
     """
-    if hasattr(env, ENV_TAG_KEY):
-        tmp = getattr(env, ENV_TAG_KEY)
-        for tag in tmp.keys():
-            try:
-                tmp[tag].rm_doc(docname)
-            except KeyError:
-                # KeyError is raised if ``docname`` is not in the set referenced
-                # by ``tmp[tag]``.
-                pass
+    doc_tags = getattr(env, ENV_DOC_KEY).pop(docname, ())
 
-    # print("[DEBUG] purge_document_from_tags() - {}".format(docname))
-    # print("[DEBUG] tags: {!r}".format(getattr(env, ENV_TAG_KEY, None)))
+    tmp = getattr(env, ENV_TAG_KEY)
+    for tag in doc_tags:
+        tmp[tag].rm_doc(docname)
 
 
 def merge_tags(app, env, docname, other):
@@ -353,17 +314,28 @@ def merge_tags(app, env, docname, other):
     This function is meant to be attached to Sphinx's ``env-merge-info`` event
     and will enable the extension to work with parallel builds.
     """
-    if not hasattr(env, ENV_TAG_KEY):
-        setattr(env, ENV_TAG_KEY, TagDefaultDict(CTTag))
+    tmp_o = getattr(other, ENV_TAG_KEY)
 
-    if hasattr(other, ENV_TAG_KEY):
-        tmp = getattr(env, ENV_TAG_KEY)
-        tmp_o = getattr(other, ENV_TAG_KEY)
-        for tag in tmp_o.keys():
-            tmp[tag].merge(tmp_o[tag])
+    # Nothing to merge, if ``other`` did not encounter any tags.
+    if not tmp_o:
+        return
 
-    # print("[DEBUG] merge_tags() - {}".format(docname))
-    # print("[DEBUG] tags: {!r}".format(getattr(env, ENV_TAG_KEY, None)))
+    # ``other`` is discarded after merging, so its data structures and
+    # instances may be adopted directly.
+    tmp = getattr(env, ENV_TAG_KEY)
+    if not tmp:
+        setattr(env, ENV_TAG_KEY, tmp_o)
+        setattr(env, ENV_DOC_KEY, getattr(other, ENV_DOC_KEY))
+        return
+
+    for name, tag in tmp_o.items():
+        existing = tmp.get(name)
+        if existing is None:
+            tmp[name] = tag
+        else:
+            existing.merge(tag)
+
+    getattr(env, ENV_DOC_KEY).update(getattr(other, ENV_DOC_KEY))
 
 
 class ContentTagDirective(SphinxDirective):
@@ -400,26 +372,39 @@ class ContentTagDirective(SphinxDirective):
         processed document (``self.env.docname``) is added to the list of
         documents associated with those tags.
         """
-        # ``arguments[0]`` is a ``str``, so just split by ";" (the seperator)
-        # and trim whitespaces...
-        tag_list = [tag.strip() for tag in self.arguments[0].split(";")]
-        # ... and convert non-empty strings to lower case.
-        tag_list = [tag.lower() for tag in tag_list if tag]
-        tag_list = set(tag_list)
-        # print("[DEBUG] tag_list: {!r}".format(tag_list))
-
-        # Add the documents to all associated tags
-        if not hasattr(self.env, ENV_TAG_KEY):
-            setattr(self.env, ENV_TAG_KEY, TagDefaultDict(CTTag))
-
-        for tag in tag_list:
-            getattr(self.env, ENV_TAG_KEY)[tag].add_doc(
-                self.env.docname,
-                "",
-                self.env.config.ct_tag_page_url_template,
-            )
-
-        # print("[DEBUG] tags: {!r}".format(getattr(self.env, ENV_TAG_KEY)))
+        # ``arguments[0]`` is a ``str``, so just split by ";" (the seperator),
+        # trim whitespaces and convert non-empty strings to lower case. This is
+        # done in a single pass, without intermediate lists.
+        #
+        # The names are interned, so all documents share the very same ``str``
+        # objects in ``ENV_TAG_KEY``, ``ENV_DOC_KEY`` and the ``CTTag``
+        # instances.
+        tag_list = frozenset(
+            sys.intern(tag)
+            for tag in (raw.strip().lower() for raw in self.arguments[0].split(";"))
+            if tag
+        )
+
+        # Resolve the required objects once, not per tag
+        docname = self.env.docname
+        doc_tags = getattr(self.env, ENV_DOC_KEY)
+        pagename_template = self.env.config.ct_tag_page_url_template
+        tags = getattr(self.env, ENV_TAG_KEY)
+
+        # Add the documents to all associated tags, creating the tags as
+        # required.
+        for name in tag_list:
+            tag = tags.get(name)
+            if tag is None:
+                tag = tags[name] = CTTag(name, pagename_template.format(name))
+            tag.add_doc(docname, "")
+
+        # Keep track of the document's tags. A document may use the directive
+        # more than once, so combine the tags with the already known ones.
+        known_tags = doc_tags.get(docname)
+        if known_tags:
+            tag_list = known_tags | tag_list
+        doc_tags[docname] = _tag_set_cache.setdefault(tag_list, tag_list)
 
         # as of now, don't add anything to the doctree
         return []
@@ -442,15 +427,16 @@ def setup(app):
 
     app.add_directive("tags", ContentTagDirective)
 
+    app.connect("builder-inited", init_env)
     app.connect("env-purge-doc", purge_document_from_tags)
     app.connect("env-updated", update_doc_titles)
+    app.connect("env-updated", update_doc_tags)
     app.connect("env-merge-info", merge_tags)
     app.connect("html-collect-pages", add_tag_pages)
-    app.connect("html-page-context", add_tags_to_render_context)
 
     return {
         "version": "0.0.1",
-        "env-version": "1",
+        "env-version": "9",
         "parallel_read_safe": True,
         "parallel_write_safe": True,
     }
@@ -29,10 +29,11 @@ displays).
 
 
 # Python imports
-import logging
-import logging.config
+import os
 import urllib.parse
-from functools import total_ordering
+from bisect import bisect_left, insort
+from functools import lru_cache
+from operator import attrgetter, itemgetter
 from pathlib import Path
 
 # Sphinx imports
@@ -52,6 +53,9 @@ from docutils import nodes
 logger = logging.getLogger(__name__)
 
 
+# Get the ``width`` of a ``ResponsiveImageSourceFile``, used as sorting key.
+_get_width = attrgetter("width")
+
 # Map filename extensions to mime types.
 EXT_TO_MIME = {
     ".jpg": "image/jpeg",
@@ -62,20 +66,29 @@ EXT_TO_MIME = {
 }
 
 
+@lru_cache(maxsize=4)
 def _get_sorted_format_list(format_list, reverse=False):
     """Apply sorting to the list of image formats.
 
     This function is meant to be used with the extension's configuration value
-    ``responsive_images_formats``. It applies the priority and returns a list
-    of formats, given as :py:`str`.
-    """
-    tmp = format_list
-    tmp.sort(key=lambda tup: tup[1], reverse=reverse)
+    ``responsive_images_formats``. It applies the priority and returns a
+    ``tuple`` of formats, given as :py:`str`.
 
-    return [f[0] for f in tmp]
+    Formats without a known MIME type (see ``EXT_TO_MIME``) are dropped, as
+    the extension can't generate markup for them. The configuration is checked
+    in ``integrate_into_build_process()``.
 
+    The configuration value is not modified. The results are cached, so the
+    configuration value has to be provided as a ``tuple``.
+    """
+    return tuple(
+        f[0]
+        for f in sorted(format_list, key=itemgetter(1), reverse=reverse)
+        if f[0] in EXT_TO_MIME
+    )
 
-def _get_image_size(filename):
+
+def _get_image_size(filename, dim_cache=None):
     """Return the image's width and height.
 
     This wraps around ``imagesize`` to make its interface usable by the
@@ -85,15 +98,46 @@ def _get_image_size(filename):
     removes all exception handling, as exceptions are handled in the
     directive's ``_get_all_candidates()``.
 
+    If ``dim_cache`` is provided, the results are cached by filename and only
+    re-used as long as the file's modification time and its size did not
+    change.
+
     Parameters
     ----------
     filename : str or Path
         The filename including the path relative to Sphinx's working directory.
+    dim_cache : dict, None
+        A dictionary, mapping filenames to ``((mtime, file size), dimensions)``
+        tuples. It is updated in place.
 
     Returns
     -------
     tuple, None
     """
+    if dim_cache is None:
+        return _read_image_size(filename)
+
+    # ``os.stat()`` raises ``FileNotFoundError`` for missing files, just like
+    # ``imagesize`` does.
+    stat = os.stat(filename)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    key = str(filename)
+
+    cached = dim_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    dimensions = _read_image_size(filename)
+    dim_cache[key] = (signature, dimensions)
+
+    return dimensions
+
+
+def _read_image_size(filename):
+    """Actually read the image's width and height from the file.
+
+    See ``_get_image_size()``.
+    """
     size = imagesize.get(filename)
 
     if size[0] == -1:
@@ -104,7 +148,6 @@ def _get_image_size(filename):
     return size
 
 
-@total_ordering
 class ResponsiveImageSourceFile:
     """Represent a single image source file.
 
@@ -116,19 +159,24 @@ class ResponsiveImageSourceFile:
 
     Parameters
     ----------
-    img_path : :class:`Path`
+    img_path : str
         The filename, including it's path (relative to Sphinx's source
         directory).
     src_dir : str
         The path to Sphinx's source directory.
     file_width: int, None
     file_height: int, None
+    dim_cache: dict, None
+        Cache for the image's dimensions, see ``_get_image_size()``.
+    mime: str, None
+        The MIME type of the image source file. If it is not provided, it is
+        derived from the file's extension.
 
     Attributes
     ----------
-    img_path : Path
+    img_path : str
         The actual path (relative to Sphinx's source directory) to the image
-        file.
+        file. It is kept as plain ``str``, as it is mainly used for lookups.
 
         Note: This is **not** the final path for Sphinx's output/build process.
     width: int
@@ -144,8 +192,20 @@ class ResponsiveImageSourceFile:
     class ProcessingError(RuntimeError):
         """Indicate problems during processing."""
 
-    def __init__(self, img_path, srcdir, file_width=None, file_height=None):
-        file_dim = _get_image_size(Path(srcdir, img_path))
+    # There is one instance per responsive image source file, so avoid the
+    # per-instance ``__dict__``.
+    __slots__ = ("img_path", "width", "height", "mime", "_key")
+
+    def __init__(
+        self,
+        img_path,
+        srcdir,
+        file_width=None,
+        file_height=None,
+        dim_cache=None,
+        mime=None,
+    ):
+        file_dim = _get_image_size(os.path.join(srcdir, img_path), dim_cache)
 
         if file_dim is None:
             if (file_width is None) or (file_height is None):
@@ -156,26 +216,52 @@ class ResponsiveImageSourceFile:
         self.img_path = img_path
         self.width = file_dim[0]
         self.height = file_dim[1]
-        self.mime = EXT_TO_MIME[img_path.suffix]
+        self.mime = mime or EXT_TO_MIME[os.path.splitext(img_path)[1]]
+
+        # The instances are not modified after creation, so their internal
+        # representation is determined once.
+        #
+        # Note: Only the ``tuple`` is stored, not its hash, because the
+        #       instances are pickled with the doctrees, while hashes of
+        #       ``str`` objects are only valid per process.
+        self._key = (self.img_path, self.width, self.height, self.mime)
 
     def __eq__(self, other):
         """Check equality with ``other`` object."""
         # see https://stackoverflow.com/a/2909119
         # see https://stackoverflow.com/a/8796908
         if isinstance(other, ResponsiveImageSourceFile):
-            return self.__key() == other.__key()
+            return self._key == other._key
         return NotImplemented
 
     def __hash__(self):
         """Provide a unique representation of the instance."""
         # see https://stackoverflow.com/a/2909119
-        return hash(self.__key())
+        return hash(self._key)
 
     def __lt__(self, other):
         """Check equality with ``other`` object."""
         # see https://stackoverflow.com/a/8796908
         if isinstance(other, ResponsiveImageSourceFile):
-            return self.__key() < other.__key()
+            return self._key < other._key
+        return NotImplemented
+
+    def __le__(self, other):
+        """Check if the instance sorts before or equal to ``other``."""
+        if isinstance(other, ResponsiveImageSourceFile):
+            return self._key <= other._key
+        return NotImplemented
+
+    def __gt__(self, other):
+        """Check if the instance sorts after ``other``."""
+        if isinstance(other, ResponsiveImageSourceFile):
+            return self._key > other._key
+        return NotImplemented
+
+    def __ge__(self, other):
+        """Check if the instance sorts after or equal to ``other``."""
+        if isinstance(other, ResponsiveImageSourceFile):
+            return self._key >= other._key
         return NotImplemented
 
     def __repr__(self):
@@ -185,11 +271,6 @@ class ResponsiveImageSourceFile:
             self.img_path.__repr__(), self.width.__repr__(), self.height.__repr__()
         )
 
-    def __key(self):
-        """Provide internal representation of the instance."""
-        # see https://stackoverflow.com/a/2909119
-        return (self.img_path, self.width, self.height, self.mime)
-
 
 class ResponsiveImageSources:
     """A set of responsive image sources.
@@ -197,12 +278,19 @@ class ResponsiveImageSources:
     The class is meant to manage the available responsive image sources,
     represented as :class:`ResponsiveImageSourceFile` instances **per node**.
 
-    It wraps around Python's ``set`` and provides several functions to access
-    and filter the sources.
+    The sources are stored in a ``dict``, using their ``img_path`` as keys.
+    Additionally, the sources are grouped by their MIME type in lists, which
+    are kept sorted by width, so the sources of a given format can be provided
+    without filtering and sorting all sources.
     """
 
     def __init__(self):
-        self._sources = set()
+        self._sources = {}
+        self._by_mime = {}
+
+    def __iter__(self):
+        """Iterate the sources."""
+        return iter(self._sources.values())
 
     def __len__(self):
         """Get the number of sources."""
@@ -214,29 +302,32 @@ class ResponsiveImageSources:
 
         new_source : ResponsiveImageSourceFile
         """
-        if isinstance(new_source, ResponsiveImageSourceFile):
-            return self._sources.add(new_source)
-        return NotImplemented
+        if not isinstance(new_source, ResponsiveImageSourceFile):
+            return NotImplemented
+
+        old_source = self._sources.get(new_source.img_path)
+        if old_source is not None:
+            self._by_mime[old_source.mime].remove(old_source)
+
+        self._sources[new_source.img_path] = new_source
+        insort(
+            self._by_mime.setdefault(new_source.mime, []),
+            new_source,
+            key=_get_width,
+        )
 
     def get_by_img_path(self, img_path):
         """Return an ``ResponsiveImageSourceFile`` by its path.
 
         Parameters
         ----------
-        img_path : Path
+        img_path : str
 
         Returns
         -------
-        ResponsiveImageSourceFile
+        ResponsiveImageSourceFile, None
         """
-        # see https://stackoverflow.com/a/22693614
-        #
-        # The list comprehension *should* return just a single element, which
-        # is returned with ``next(iter(...))``. If the comprehension is empty,
-        # ``None`` is returned.
-        return next(
-            iter({item for item in self._sources if item.img_path == img_path}), None
-        )
+        return self._sources.get(img_path)
 
     def get_fallback(self, fileformat):
         """Get the *smallest* image source of the given *fileformat*.
@@ -252,13 +343,13 @@ class ResponsiveImageSources:
         return self.get_source_files(fileformat=fileformat)[0]
 
     def get_img_path_list(self):
-        """Get a flat list of the sources' paths.
+        """Get the sources' paths.
 
         Returns
         -------
-        list(str)
+        dict_keys(str)
         """
-        return {item.img_path for item in self._sources}
+        return self._sources.keys()
 
     def get_source_files(self, fileformat=None, min_width=0):
         """Get all images sources, ordered by width.
@@ -271,23 +362,52 @@ class ResponsiveImageSources:
         min_width : int
         """
         if fileformat is None:
-            source_files = list(
-                {item for item in self._sources if (item.width >= min_width)}
-            )
-        else:
-            source_files = list(
-                {
-                    item
-                    for item in self._sources
-                    if (
-                        item.width >= min_width and item.mime == EXT_TO_MIME[fileformat]
-                    )
-                }
+            return sorted(
+                (item for item in self._sources.values() if item.width >= min_width),
+                key=_get_width,
             )
 
-        source_files.sort(key=lambda src: src.width)
+        # The sources of the given format are already sorted by width, so the
+        # matching sources are a slice of that list.
+        source_files = self._by_mime.get(EXT_TO_MIME[fileformat], [])
+
+        return source_files[bisect_left(source_files, min_width, key=_get_width) :]
+
+
+class ResponsiveImageFiles(FilenameUniqDict):
+    """Track the responsive image source files of the build environment.
+
+    This is Sphinx's ``FilenameUniqDict``, which maps the files to the
+    documents they appear in and their unique output names. Additionally, the
+    files are tracked per document, so purging a document only touches its
+    own files instead of scanning all files of the project.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._files_by_doc = {}
+
+    def add_file(self, docname, newfile):
+        """Add ``newfile`` as a file of ``docname``."""
+        self._files_by_doc.setdefault(docname, set()).add(newfile)
+        return super().add_file(docname, newfile)
+
+    def purge_doc(self, docname):
+        """Remove ``docname`` and drop the files no longer used by any document."""
+        for filename in self._files_by_doc.pop(docname, ()):
+            docs, unique = self[filename]
+            docs.discard(docname)
+            if not docs:
+                del self[filename]
+                self._existing.discard(unique)
+
+    def __getstate__(self):
+        """Provide the state for pickling."""
+        return (self._existing, self._files_by_doc)
 
-        return source_files
+    def __setstate__(self, state):
+        """Restore the state after unpickling."""
+        self._existing, self._files_by_doc = state
 
 
 class ResponsiveImageCollector(EnvironmentCollector):
@@ -307,8 +427,18 @@ class ResponsiveImageCollector(EnvironmentCollector):
     source file has been parsed into a ``doctree``. ``process_doc()`` is then
     called for every document (Sphinx's core event ``doctree-read`` is used
     to run the method).
+
+    The contents of the image directories are listed once per build and cached
+    in ``_dir_cache``, so the responsive versions of an image can be determined
+    without probing every possible filename on the filesystem. Likewise, the
+    resolved paths of the images' URIs are cached in ``_uri_cache``.
     """
 
+    def __init__(self):
+        super().__init__()
+        self._dir_cache = {}
+        self._uri_cache = {}
+
     def clear_doc(self, app, env, docname):
         """Remove a document from ``responsive_images``.
 
@@ -322,6 +452,7 @@ class ResponsiveImageCollector(EnvironmentCollector):
         This method is required to enable parallel builds.
         """
         env.responsive_images.merge_other(docnames, other.responsive_images)
+        env.responsive_images_dimensions.update(other.responsive_images_dimensions)
 
     def process_doc(self, app, doctree):
         """Process the ``image`` nodes of a document to identify responsive images.
@@ -329,13 +460,26 @@ class ResponsiveImageCollector(EnvironmentCollector):
         The real magic is done in ``collect_sources()`` and its result is then
         added to the processed ``node`` instance and to the document's
         dependencies.
+
+        Documents without images are skipped right away, just like all
+        documents, if no responsive versions are configured at all.
         """
+        size_suffixes = app.config.responsive_images_size_suffixes
+        if not (size_suffixes and app.config.responsive_images_formats):
+            return
+
+        image_nodes = list(doctree.findall(nodes.image))
+        if not image_nodes:
+            return
+
         docname = app.env.docname
+        docdir = os.path.dirname(docname)
+        add_file = app.env.responsive_images.add_file
         formats = _get_sorted_format_list(
-            app.config.responsive_images_formats, reverse=True
+            tuple(app.config.responsive_images_formats), reverse=True
         )
 
-        for node in doctree.findall(nodes.image):
+        for node in image_nodes:
             # We can't determine, if we're running before or after the built-in
             # ``ImageCollector``, which modifies the node while processing it.
             # We replicate its behaviour, but don't modify the existing
@@ -351,28 +495,38 @@ class ResponsiveImageCollector(EnvironmentCollector):
             except KeyError:
                 node_uri = node["uri"]
 
-            imguri = search_image_for_language(node_uri, app.env)
-
-            img_path, _ = app.env.relfn2path(imguri, docname)
+            # Resolving the URI only depends on the document's directory, so
+            # images referenced from several documents are resolved once.
+            try:
+                img_path = self._uri_cache[(node_uri, docdir)]
+            except KeyError:
+                imguri = search_image_for_language(node_uri, app.env)
+                img_path, _ = app.env.relfn2path(imguri, docname)
+                self._uri_cache[(node_uri, docdir)] = img_path
 
             # Determine the available *responsive* versions of the image
-            self.collect_sources(
+            sources = self.collect_sources(
                 img_path,
-                app.config.responsive_images_size_suffixes,
+                size_suffixes,
                 formats,
                 app.srcdir,
+                app.env.responsive_images_dimensions,
             )
 
             # Add the *responsive sources* to the document's dependencies and
             # track them in the build environment.
-            for src_path in self.sources.get_img_path_list():
-                app.env.dependencies[docname].add(str(src_path))
-                app.env.responsive_images.add_file(docname, str(src_path))
+            src_paths = list(sources.get_img_path_list())
+            if src_paths:
+                app.env.dependencies[docname].update(src_paths)
+                for src_path in src_paths:
+                    add_file(docname, src_path)
 
             # Add the *responsive sources* to the actual node
-            node["responsive_sources"] = self.sources
+            node["responsive_sources"] = sources
 
-    def collect_sources(self, ref_path, size_suffixes, formats, app_srcdir):
+    def collect_sources(
+        self, ref_path, size_suffixes, formats, app_srcdir, dim_cache=None
+    ):
         """Determine the responsive versions of the image.
 
         Parameters
@@ -387,34 +541,76 @@ class ResponsiveImageCollector(EnvironmentCollector):
             A list of formats (file extensions).
         app_srcdir : str
             Full path to Sphinx's source directory.
+        dim_cache : dict, None
+            Cache for the images' dimensions, see ``_get_image_size()``.
+
+        Returns
+        -------
+        ResponsiveImageSources
+            The available responsive versions of the image.
         """
-        self.sources = ResponsiveImageSources()
+        sources = ResponsiveImageSources()
 
-        # Convert the ``str`` to an actual ``Path`` object for processing
-        ref_path = Path(ref_path)
+        # The paths are handled as plain ``str``, which is cheaper than
+        # creating ``Path`` objects for all candidates.
+        parent, ref_filename = os.path.split(ref_path)
+        stem, suffix = os.path.splitext(ref_filename)
+
+        # The files of the image's directory, to skip non-existent files
+        # without hitting the filesystem.
+        available = self._list_dir(os.path.join(app_srcdir, parent))
 
         for s in size_suffixes:
-            new_stem = "{}{}".format(ref_path.stem, s)
+            new_stem = "{}{}".format(stem, s)
+
+            # Skip sizes without any files at once, instead of checking every
+            # format.
+            available_suffixes = available.get(new_stem)
+            if available_suffixes is None:
+                logger.verbose(
+                    "Responsive image sources not found: %s.* - skipping!",
+                    os.path.join(parent, new_stem),
+                )
+                continue
+
             for f in formats:
-                work_path = ref_path.with_stem(new_stem).with_suffix(f)
+                filename = new_stem + f
+
+                if f not in available_suffixes:
+                    logger.verbose(
+                        "Responsive image source not found: %s - skipping!",
+                        os.path.join(parent, filename),
+                    )
+                    continue
+
+                work_path = os.path.join(parent, filename)
 
                 try:
-                    self.sources.add(ResponsiveImageSourceFile(work_path, app_srcdir))
+                    sources.add(
+                        ResponsiveImageSourceFile(
+                            work_path,
+                            app_srcdir,
+                            dim_cache=dim_cache,
+                            mime=EXT_TO_MIME[f],
+                        )
+                    )
                 except ResponsiveImageSourceFile.ProcessingError:
                     # Could not determine image's dimensions.
                     #
                     # Try to recover from an already-processed version of the
                     # corresponding size, most likely JPG or PNG.
                     try:
-                        fallback = self.sources.get_by_img_path(
-                            ref_path.with_stem(new_stem)
+                        fallback = sources.get_by_img_path(
+                            os.path.join(parent, new_stem + suffix)
                         )
-                        self.sources.add(
+                        sources.add(
                             ResponsiveImageSourceFile(
                                 work_path,
                                 app_srcdir,
                                 file_width=fallback.width,
                                 file_height=fallback.height,
+                                dim_cache=dim_cache,
+                                mime=EXT_TO_MIME[f],
                             )
                         )
                     except Exception:
@@ -422,7 +618,8 @@ class ResponsiveImageCollector(EnvironmentCollector):
                         #       Sphinx's ``-W`` option, this will fail the
                         #       build!
                         logger.warning(
-                            "Could not determine dimensions for %s - skipping!"
+                            "Could not determine dimensions for %s - skipping!",
+                            work_path,
                         )
                 except FileNotFoundError:
                     logger.verbose(
@@ -430,8 +627,82 @@ class ResponsiveImageCollector(EnvironmentCollector):
                     )
                     continue
 
+        return sources
+
+    def _list_dir(self, path):
+        """Return the files of a directory, grouped by their stem.
+
+        The directory is only listed once, subsequent calls are served from
+        ``_dir_cache``.
+
+        Parameters
+        ----------
+        path : str
+
+        Returns
+        -------
+        dict
+            A ``dict`` with the files' stems as keys and sets of their
+            suffixes (extensions, including the leading ``.``) as values.
+        """
+        try:
+            return self._dir_cache[path]
+        except KeyError:
+            pass
+
+        files = {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    stem, suffix = os.path.splitext(entry.name)
+                    files.setdefault(stem, set()).add(suffix)
+        except FileNotFoundError:
+            pass
+
+        self._dir_cache[path] = files
+        return files
+
+
+def _get_source_plan(config):
+    """Determine the ``<source>`` elements to generate for responsive images.
+
+    The ``<source>`` elements depend on the breakpoints and the file formats,
+    as specified in the extension's configuration. These don't change during
+    a build, so this is done once and not for every image.
+
+    Note: Generating *mobile first* breakpoints is hardcoded as of now!
+
+    Parameters
+    ----------
+    config : sphinx.config.Config
+
+    Returns
+    -------
+    tuple
+        A ``tuple`` of ``(media, min_img_width, fileformat)`` tuples in the
+        order of the ``<source>`` elements. ``media`` is the prepared
+        ``media`` attribute (including a trailing space) or an empty ``str``.
+    """
+    formats = _get_sorted_format_list(tuple(config.responsive_images_formats))
+    bpoints = [(0, 0)] + config.responsive_images_layout_breakpoints
+    bpoints.sort(reverse=True)
 
-def visit_image(self, node, original_visit_image):
+    plan = []
+    for min_display_width, min_img_width in bpoints:
+        # The media query needs only to be applied if there is an actual
+        # min-width!
+        if min_display_width > 0:
+            media = f'media="(min-width: {min_display_width}px)" '
+        else:
+            media = ""
+
+        for f in formats:
+            plan.append((media, min_img_width, f))
+
+    return tuple(plan)
+
+
+def visit_image(self, node, original_visit_image, source_plan):
     """Provide the actual HTML markup for responsive images.
 
     This function handles the generation of the required markup for ``image``
@@ -446,6 +717,9 @@ def visit_image(self, node, original_visit_image):
 
     If there are no responsive image sources available, the original
     implementation of ``visit_image()`` is called.
+
+    The ``<source>`` elements are generated as specified by ``source_plan``,
+    see ``_get_source_plan()``.
     """
 
     def _get_path(basedir, img_path):
@@ -462,57 +736,43 @@ def visit_image(self, node, original_visit_image):
         )
         return original_visit_image(self, node)
 
+    # The complete markup is collected locally and then appended to the
+    # translator's ``body`` at once.
+    #
     # Start the <picture> element
-    self.body.append("<picture>")
+    markup = ["<picture>"]
 
     # Generate the <source> elements
     #
     # The <source> elements are generated depending on the breakpoints (as
-    # specified from the extension's configuration) and the file formats.
-    #
-    # Note: Generating *mobile first* breakpoints is hardcoded as of now!
-    formats = _get_sorted_format_list(self.builder.app.config.responsive_images_formats)
-    bpoints = [(0, 0)] + self.builder.app.config.responsive_images_layout_breakpoints
-    bpoints.sort(reverse=True)
+    # specified from the extension's configuration) and the file formats, as
+    # provided by ``source_plan``.
+    imgpath = self.builder.imgpath
+    images = self.builder.images
 
-    for b in bpoints:
-        for f in formats:
-            gen_source = ["<source", ">"]
-            tmp_sources = sources.get_source_files(fileformat=f, min_width=b[1])
-
-            # All further processing is only done, if there are matching source
-            # files!
-            if len(tmp_sources) > 0:
-                gen_source.insert(1, 'type="{}"'.format(tmp_sources[0].mime))
-                gen_source.insert(1, 'width="{}"'.format(tmp_sources[0].width))
-                gen_source.insert(1, 'height="{}"'.format(tmp_sources[0].height))
-
-                # The media query needs only to be applied if there is an actual
-                # min-width!
-                if b[0] > 0:
-                    gen_source.insert(1, 'media="(min-width: {}px)"'.format(b[0]))
-
-                # Include all matching source files into the ``srcset``.
-                #
-                # Provide the actual path (relative to the document's location)
-                # dynamically.
-                tmp_srcset = []
-                for s in tmp_sources:
-                    tmp_srcset.append(
-                        "{img_path} {img_width}w".format(
-                            img_path=_get_path(
-                                self.builder.imgpath,
-                                self.builder.images[str(s.img_path)],
-                            ),
-                            img_width=s.width,
-                        )
-                    )
+    for media, min_img_width, f in source_plan:
+        tmp_sources = sources.get_source_files(fileformat=f, min_width=min_img_width)
+
+        # All further processing is only done, if there are matching source
+        # files!
+        if not tmp_sources:
+            continue
 
-                gen_source.insert(1, 'srcset="{}"'.format(", ".join(tmp_srcset)))
+        # Include all matching source files into the ``srcset``.
+        #
+        # Provide the actual path (relative to the document's location)
+        # dynamically.
+        srcset = ", ".join(
+            f"{_get_path(imgpath, images[s.img_path])} {s.width}w" for s in tmp_sources
+        )
 
-                # Actually append the <source> element
-                logger.debug("Generated source: %r", gen_source)
-                self.body.append(" ".join(gen_source))
+        # Actually append the <source> element
+        smallest = tmp_sources[0]
+        markup.append(
+            f'<source srcset="{srcset}" {media}'
+            f'height="{smallest.height}" width="{smallest.width}" '
+            f'type="{smallest.mime}" >'
+        )
 
     # Create the actual <img> element
     #
@@ -546,16 +806,16 @@ def visit_image(self, node, original_visit_image):
         node,
         "img",
         "\n",
-        src=_get_path(
-            self.builder.imgpath, self.builder.images[str(fallback.img_path)]
-        ),
-        **atts
+        src=_get_path(self.builder.imgpath, self.builder.images[fallback.img_path]),
+        **atts,
     )
 
-    self.body.append(tag)
+    markup.append(tag)
 
     # Close the <picture> element
-    self.body.append("</picture>")
+    markup.append("</picture>")
+
+    self.body.append("".join(markup))
 
 
 def post_process_images(self, doctree, original_post_process_images):
@@ -596,9 +856,8 @@ def post_process_images(self, doctree, original_post_process_images):
             logger.debug("nodes.image without responsive sources - skipping!")
             continue
 
-        for s in sources._sources:
-            # logger.debug("source: %r", s)
-            s_img_path = str(s.img_path)
+        for s in sources:
+            s_img_path = s.img_path
             if s_img_path not in self.env.responsive_images:
                 continue
             # This is where the magic happens!
@@ -625,9 +884,21 @@ def integrate_into_build_process(app):
         logger.info("Detected a non-HTML builder. Skipping extension setup!")
         return
 
+    # Formats without a known MIME type are skipped while processing images,
+    # so they are reported once here.
+    for f, _ in app.config.responsive_images_formats:
+        if f not in EXT_TO_MIME:
+            logger.warning("Unsupported responsive image format %r - skipping!", f)
+
     # Setup the specific ``EnvironmentCollector`` for the responsive image sources
     if not hasattr(app.env, "responsive_images"):
-        app.env.responsive_images = FilenameUniqDict()
+        app.env.responsive_images = ResponsiveImageFiles()
+
+    # The images' dimensions are cached in the build environment, so they
+    # don't have to be read again on incremental builds, as long as the files
+    # are not modified.
+    if not hasattr(app.env, "responsive_images_dimensions"):
+        app.env.responsive_images_dimensions = {}
     app.add_env_collector(ResponsiveImageCollector)
 
     # Process *lazy-loading* of images
@@ -640,9 +911,10 @@ def integrate_into_build_process(app):
     # This code is based on the implementation in ``sphinxext-photofinish``.
     translator_class = app.builder.get_translator_class()
     original_visit_image = translator_class.visit_image
+    source_plan = _get_source_plan(app.config)
 
     def visit_image_replacement(translator, node):
-        visit_image(translator, node, original_visit_image)
+        visit_image(translator, node, original_visit_image, source_plan)
 
     translator_class.visit_image = visit_image_replacement
 
@@ -748,7 +1020,7 @@ def setup(app):
 
     return {
         "version": "0.0.1",
-        "env-version": "1",
+        "env-version": "5",
         "parallel_read_safe": True,
         "parallel_write_safe": True,
     }
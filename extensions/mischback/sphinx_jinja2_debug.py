@@ -1,4 +1,19 @@
-"""Make Jinja2's debug extension available in ``Sphinx``'s templates."""
+"""Make Jinja2's debug extension available in ``Sphinx``'s templates.
+
+The extension is only activated, if the environment variable
+``SPHINX_JINJA_DEBUG`` is set, so regular builds don't pay for it.
+
+While activated, templates may check for the global ``jinja2_debug`` to
+include ``{% debug %}`` output. As Jinja2 fails to compile templates with
+unknown tags, the ``{% debug %}`` tag should be placed in a separate template,
+which is only included if ``jinja2_debug`` is set.
+"""
+
+# Python imports
+from os import getenv
+
+ENV_DEBUG_KEY = "SPHINX_JINJA_DEBUG"
+"""Name of the environment variable to activate the extension."""
 
 
 def activate_jinja2_debug_ext(app):
@@ -10,9 +25,13 @@ def activate_jinja2_debug_ext(app):
 
     - https://jinja.palletsprojects.com/en/3.0.x/extensions/#adding-extensions
     - https://jinja.palletsprojects.com/en/3.0.x/extensions/#debug-extension
+
+    Additionally, the global ``jinja2_debug`` is made available to all
+    templates.
     """
     if hasattr(app.builder, "templates"):
         app.builder.templates.environment.add_extension("jinja2.ext.debug")
+        app.builder.templates.environment.globals["jinja2_debug"] = True
 
 
 def setup(app):
@@ -24,9 +43,10 @@ def setup(app):
 
     It connects this plugins (only) function with the ``"builder-inited"`` event, see
     https://www.sphinx-doc.org/en/master/extdev/appapi.html#sphinx-core-events
-    for reference.
+    for reference. This is only done, if ``SPHINX_JINJA_DEBUG`` is set.
     """
-    app.connect("builder-inited", activate_jinja2_debug_ext)
+    if getenv(ENV_DEBUG_KEY, False):
+        app.connect("builder-inited", activate_jinja2_debug_ext)
 
     return {
         "version": "0.0.1",